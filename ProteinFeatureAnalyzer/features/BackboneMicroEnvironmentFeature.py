@@ -1,10 +1,14 @@
 import os
+import multiprocessing
 
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn import svm
 from sklearn.ensemble import IsolationForest
 from sklearn import mixture
+from sklearn.metrics.pairwise import rbf_kernel
+from scipy.spatial import cKDTree
 import matplotlib
 matplotlib.use('TkAgg') 
 import matplotlib.pyplot as plt
@@ -16,6 +20,65 @@ from . import geometry
 from . import machine_learning
 
 
+# The OneClassSVM sweep precomputes dense kernel matrices only up to
+# this number of training points. The training kernel of 10000 points
+# takes 800 MB.
+
+MAX_PRECOMPUTED_KERNEL_SIZE = 10000
+
+def extract_from_one_file(pdb_file):
+  '''Extract backbone micro environment features from a pdb file.
+  Return an (N, 10) array of features.
+  '''
+  rows = []
+
+  structure = data_loading.structure_from_pdb_file(pdb_file)
+
+  for model in structure:
+    nearest_nb_list = geometry.get_nearest_nonbonded_residues(model)
+
+    # Get the backbone coordinates and torsions of all residues once
+
+    backbone = geometry.structure_coords(model)
+    residues = [r for chain_id in backbone for r in backbone[chain_id][0]]
+    if len(residues) == 0: continue
+
+    coords = np.concatenate([backbone[chain_id][1] for chain_id in backbone])
+    torsions = np.concatenate([np.column_stack(geometry.compute_all_phi_psi(*backbone[chain_id]))
+        for chain_id in backbone])
+
+    # Get the pairs whose torsions are all defined
+
+    index = {id(r) : i for i, r in enumerate(residues)}
+    pairs = [(index[id(res1)], index[id(res2)]) for res1, res2 in nearest_nb_list
+            if id(res1) in index and id(res2) in index]
+    if len(pairs) == 0: continue
+
+    i1, i2 = np.array(pairs).T
+    defined = np.isfinite(torsions[i1]).all(axis=1) & np.isfinite(torsions[i2]).all(axis=1)
+    i1 = i1[defined]
+    i2 = i2[defined]
+
+    # Get the coordinate frames of all residues
+
+    stubs, cas = geometry.compute_all_stub_matrices(coords)
+    stubs1_T = stubs[i1].transpose(0, 2, 1)
+
+    # Get the relative positions of the second residues 
+
+    shifts = np.matmul(stubs1_T, (cas[i2] - cas[i1])[:, :, np.newaxis])[:, :, 0]
+
+    # Get the relative orientations of the second residues.
+    # The rotation matrices are in the frames of the first residues.
+
+    rot_matrices = np.matmul(stubs1_T, stubs[i2])
+    txs, tys, tzs = geometry.rotation_matrices_to_euler_angles(rot_matrices)
+
+    rows.append(np.column_stack([torsions[i1], torsions[i2], shifts, txs, tys, tzs]))
+
+  return np.concatenate(rows) if len(rows) > 0 else np.empty((0, 10))
+
+
 class BackboneMicroEnvironmentFeature(Feature):
   '''The BackboneMicroEnvironmentFeature analyzes the micro environments
   of backbones of each residue. The micro environemt is formed by the residue
@@ -23,65 +86,113 @@ class BackboneMicroEnvironmentFeature(Feature):
   
   def __init__(self):
     super().__init__()
-  
-  def extract(self, input_path, total_num_threads=1, my_id=0):
-    '''Extract features from structures in the input path.'''
-    for f in self.list_my_jobs(input_path, total_num_threads, my_id):
-      if f.endswith('.pdb'):
-        self.extract_from_one_file(os.path.join(input_path, f))
 
-  def extract_from_one_file(self, pdb_file):
-    structure = data_loading.structure_from_pdb_file(pdb_file)
-  
-    for model in structure:
-      nearest_nb_list = geometry.get_nearest_nonbonded_residues(model)
-   
-      for res1, res2 in nearest_nb_list:
-        feature_dict ={}
-        
-        # Get the torsions
-        
-        try:
-          feature_dict['phi1'] = geometry.get_phi(res1.get_parent(), res1) 
-          feature_dict['psi1'] = geometry.get_psi(res1.get_parent(), res1) 
-          feature_dict['phi2'] = geometry.get_phi(res2.get_parent(), res2) 
-          feature_dict['psi2'] = geometry.get_psi(res2.get_parent(), res2) 
-        except:
-          continue
+    # The features are stored in the rows of a growing buffer. The columns are 
+    # (phi1, psi1, phi2, psi2, shift_x, shift_y, shift_z, theta_x, theta_y, theta_z).
+
+    self._buf = np.empty((0, 10))
+    self._n = 0
+
+    # Random samples keyed by (NUM_SAMPLES, transform_features)
+
+    self._random_cache = {}
+
+  @property
+  def features(self):
+    '''An (N, 10) array of all features.'''
+    return self._buf[:self._n]
 
-        # Get the relative position of the second residue 
+  def feature_columns(self):
+    '''Return a dictionary that maps feature names to the corresponding
+    columns of the feature array. The value of 'shift' is a 3xN array.
+    '''
+    f = self.features
+    return {'phi1':f[:, 0], 'psi1':f[:, 1], 'phi2':f[:, 2], 'psi2':f[:, 3], 'shift':f[:, 4:7].T,
+            'theta_x':f[:, 7], 'theta_y':f[:, 8], 'theta_z':f[:, 9]}
+
+  def _buf_extend(self, rows):
+    '''Append an (M, 10) array of features to the buffer. The capacity of
+    the buffer is doubled when it overflows.
+    '''
+    if len(rows) == 0: return
+    n_new = self._n + len(rows)
 
-        s_matrix, origin = geometry.get_residue_stub_matrix(res1)
-        shift_global = res2['CA'].get_coord() - res1['CA'].get_coord()
-        feature_dict['shift'] = np.matmul(np.array(s_matrix.T), np.array(shift_global))
+    if n_new > len(self._buf):
+      buf = np.empty((max(n_new, 2 * len(self._buf)), 10))
+      buf[:self._n] = self._buf[:self._n]
+      self._buf = buf
 
-        # Get the relative orientation of the second residue
+    self._buf[self._n:n_new] = rows
+    self._n = n_new
+  
+  def extract(self, input_path, total_num_threads=1, my_id=0, num_processes=1, data_path=None):
+    '''Extract features from structures in the input path. The files
+    of this job are processed by num_processes worker processes. If
+    data_path is given, the features of each file are appended to the
+    feature file in data_path right after extraction instead of being kept
+    in memory.
+    '''
+    pdb_files = [os.path.join(input_path, f) for f in self.list_my_jobs(input_path, total_num_threads, my_id)
+            if f.endswith('.pdb')]
 
-        s_matrix2, origin2 = geometry.get_residue_stub_matrix(res2)
-        rot_matrix = np.dot(s_matrix.T, s_matrix2) # Rotation matrix in the frame of the first residue
-        feature_dict['theta_x'], feature_dict['theta_y'], feature_dict['theta_z'] = \
-                geometry.rotation_matrix_to_euler_angles(np.array(rot_matrix))
+    def store(rows):
+      if data_path:
+        self.append_to_binary(rows, os.path.join(data_path, 'bb_micro_env_features.bin'))
+      else:
+        self._buf_extend(rows)
 
-        self.feature_list.append(feature_dict)
+    if num_processes > 1:
+      with multiprocessing.Pool(num_processes) as pool:
+        for rows in pool.imap(extract_from_one_file, pdb_files, chunksize=8):
+          store(rows)
 
-    #print(self.feature_list)
+    else:
+      for pdb_file in pdb_files:
+        store(extract_from_one_file(pdb_file))
+
+  def extract_from_one_file(self, pdb_file):
+    '''Extract features from a pdb file.'''
+    self._buf_extend(extract_from_one_file(pdb_file))
 
   def save(self, data_path):
-    '''Save the data into a csv file.'''
-    data = [ (d['phi1'], d['psi1'], d['phi2'], d['psi2'], d['shift'][0], d['shift'][1], d['shift'][2],
-            d['theta_x'], d['theta_y'], d['theta_z']) 
-            for d in self.feature_list ]
-    df = pd.DataFrame(data)
-    
-    self.append_to_csv(df, os.path.join(data_path, 'bb_micro_env_features.csv'))
+    '''Save the data into a binary file of little-endian float32 values.'''
+    self.append_to_binary(self.features, os.path.join(data_path, 'bb_micro_env_features.bin'))
 
   def load(self, data_path):
-    '''Load data from a csv file.'''
-    df = pd.read_csv(os.path.join(data_path, 'bb_micro_env_features.csv'), header=None)
+    '''Load data from a binary file. If no feature is loaded yet, the
+    file is memory-mapped read-only instead of being read into memory.
+    A csv file saved by older versions is converted first if there
+    is no binary file.
+    '''
+    bin_file = os.path.join(data_path, 'bb_micro_env_features.bin')
     
-    for index, row in df.iterrows():
-      self.feature_list.append({'phi1':row[0], 'psi1':row[1], 'phi2':row[2], 'psi2':row[3],
-          'shift':np.array([row[4], row[5], row[6]]), 'theta_x':row[7], 'theta_y':row[8], 'theta_z':row[9] })
+    if not os.path.exists(bin_file):
+      self.csv_to_binary(data_path)
+
+    if os.path.getsize(bin_file) == 0:
+      return
+
+    data = np.memmap(bin_file, dtype='<f4', mode='r').reshape(-1, 10)
+
+    if self._n == 0:
+      self._buf = data
+      self._n = len(data)
+    else:
+      self._buf_extend(data)
+
+  def csv_to_binary(self, data_path):
+    '''Convert the features saved in the csv format by older versions
+    into the binary format. Nothing is done if the binary file exists.
+    '''
+    bin_file = os.path.join(data_path, 'bb_micro_env_features.bin')
+
+    with self.make_file_lock(bin_file):
+      if os.path.exists(bin_file): return
+
+      df = pd.read_csv(os.path.join(data_path, 'bb_micro_env_features.csv'), header=None)
+
+      with open(bin_file, 'wb') as f:
+        df.to_numpy().astype('<f4').tofile(f)
 
   def feature_dict_to_machine_learning_features(self, feature_dict):
     '''Given a feature dictionary, return its corresponding features
@@ -91,35 +202,28 @@ class BackboneMicroEnvironmentFeature(Feature):
     (Alas, the unit quaterions is diffeomorphic to S3, so its not homomorphic
     to SO(3).)
     '''
-    return machine_learning.angle_to_cos_sin(feature_dict['phi1']) \
-            + machine_learning.angle_to_cos_sin(feature_dict['psi1']) \
-            + machine_learning.angle_to_cos_sin(feature_dict['phi2']) \
-            + machine_learning.angle_to_cos_sin(feature_dict['psi2']) \
-            + list(feature_dict['shift']) \
-            + list(geometry.euler_angles_to_rotation_matrix(feature_dict['theta_x'],
-                feature_dict['theta_y'], feature_dict['theta_z']).reshape(9))
-
-  def transform_features(self, feature_list):
-    '''Transform feature representations. The arguement feature_list
-    could be a list of dictionary or a list of list.
+    d = feature_dict
+    return list(self.transform_features(np.array([[d['phi1'], d['psi1'], d['phi2'], d['psi2']]
+        + list(d['shift']) + [d['theta_x'], d['theta_y'], d['theta_z']]]))[0])
+
+  def transform_features(self, feature_array):
+    '''Transform feature representations. The arguement feature_array
+    is an (N, 10) array of features. Return an (N, 20) numpy array of
+    machine learning features.
     '''
-    if isinstance(feature_list[0], dict):
-      return [self.feature_dict_to_machine_learning_features(d) for d in feature_list]
-    
-    else:
-      return [machine_learning.angle_to_cos_sin(d[0]) + machine_learning.angle_to_cos_sin(d[1]) \
-            + machine_learning.angle_to_cos_sin(d[2]) + machine_learning.angle_to_cos_sin(d[3]) \
-            + list(d[4]) \
-            + list(geometry.euler_angles_to_rotation_matrix(d[5], d[6], d[7]).reshape(9))
-            for d in feature_list]
+    rot_matrices = geometry.euler_angles_to_rotation_matrices(feature_array[:, 7],
+            feature_array[:, 8], feature_array[:, 9])
+
+    return np.hstack([machine_learning.angles_to_cos_sin(feature_array[:, 0:4]), feature_array[:, 4:7],
+        rot_matrices.reshape(-1, 9)])
 
   def learn(self, clf_type="OneClassSVM", transform_features=False):
     '''Train a machine learning classifier on the features.'''
    
-    all_data = [[d['phi1'], d['psi1'], d['phi2'], d['psi2']] + list(d['shift']) + [d['theta_x'], d['theta_y'], d['theta_z']]
-            for d in self.feature_list]
+    all_data = self.features
     if transform_features:
-      all_data = self.transform_features(self.feature_list)
+      all_data = self.transform_features(all_data)
+    all_data = np.ascontiguousarray(all_data, dtype=np.float64)
     n_data = len(all_data)
 
     training_data = all_data[0:int(0.6 * n_data)]
@@ -128,78 +232,139 @@ class BackboneMicroEnvironmentFeature(Feature):
   
     # Train the classifier
     
-    if clf_type == "OneClassSVM":
-      nus = [0.05, 0.02, 0.01, 0.005, 0.002, 0.001]
-      least_error = len(test_data)
+    with sklearn.config_context(assume_finite=True):
+      if clf_type == "OneClassSVM":
+        nus = [0.05, 0.02, 0.01, 0.005, 0.002, 0.001]
+        least_error = len(test_data)
 
-      for i in range(len(nus)):
-        print("nu = {0}".format(nus[i]))
+        # The gamma is the same as gamma='auto'
 
-        clf = svm.OneClassSVM(nu=nus[i], kernel="rbf", gamma='auto')
-        clf.fit(training_data)
+        self.clf_training_data = training_data
+        self.clf_gamma = 1.0 / self.clf_training_data.shape[1]
+
+        # Precompute the RBF kernels shared by the classifiers of all nus
+        # if they fit in memory. Otherwise let libsvm compute the kernel.
+
+        precompute_kernel = len(training_data) <= MAX_PRECOMPUTED_KERNEL_SIZE
+
+        if precompute_kernel:
+          X_train = rbf_kernel(self.clf_training_data, gamma=self.clf_gamma)
+          X_test = rbf_kernel(test_data, self.clf_training_data, gamma=self.clf_gamma)
+        else:
+          X_train = training_data
+          X_test = test_data
+
+        for i in range(len(nus)):
+          print("nu = {0}".format(nus[i]))
+
+          if precompute_kernel:
+            clf = svm.OneClassSVM(nu=nus[i], kernel="precomputed")
+          else:
+            clf = svm.OneClassSVM(nu=nus[i], kernel="rbf", gamma=self.clf_gamma)
+          clf.fit(X_train)
         
-        predictions = clf.predict(training_data)
-        print("{0}/{1} training error.".format(len(predictions[-1 == predictions]), len(training_data)))
+          predictions = clf.predict(X_train)
+          print("{0}/{1} training error.".format((predictions == -1).sum(), len(training_data)))
         
-        predictions = clf.predict(test_data)
-        print("{0}/{1} test error.\n".format(len(predictions[-1 == predictions]), len(test_data)))
+          predictions = clf.predict(X_test)
+          test_error = (predictions == -1).sum()
+          print("{0}/{1} test error.\n".format(test_error, len(test_data)))
+
+          if test_error < least_error:
+            least_error = test_error
+            self.clf = clf
 
-        if len(predictions[-1 == predictions]) < least_error:
-          least_error = len(predictions[-1 == predictions])
-          self.clf = clf
+        self.init_svm_decision_function()
     
-    elif clf_type == "IsolationForest": 
-      self.clf = IsolationForest(max_samples=50000,
-			contamination=0.05, random_state=np.random.RandomState(42))
-      self.clf.fit(training_data)
+      elif clf_type == "IsolationForest": 
+        self.clf = IsolationForest(max_samples=50000,
+                contamination=0.05, random_state=np.random.RandomState(42))
+        self.clf.fit(training_data)
    
     # Print Training results
     
-    predictions = self.clf.predict(cv_data)
-    print("{0}/{1} cross validation error.".format(len(predictions[-1 == predictions]), len(cv_data)))
+    predictions = self.classify(cv_data)
+    print("{0}/{1} cross validation error.".format((predictions == -1).sum(), len(cv_data)))
     
     if clf_type == "OneClassSVM":
       print("{0} support vectors found.".format(len(self.clf.support_)))
 
+  def init_svm_decision_function(self):
+    '''Cache the parameters of the decision function of the trained
+    OneClassSVM, which is sum_i(a_i * K(sv_i, x)) + b.
+    '''
+    self.clf_support_vectors = self.clf_training_data[self.clf.support_]
+    self.clf_dual_coef = self.clf.dual_coef_.ravel()
+    self.clf_intercept = self.clf.intercept_[0]
+
+  def classify(self, data):
+    '''Make predictions with the trained classifier. The data should
+    be in the same representation as the training data.
+    '''
+    data = np.ascontiguousarray(data, dtype=np.float64)
+
+    with sklearn.config_context(assume_finite=True):
+      if isinstance(self.clf, svm.OneClassSVM) and self.clf.kernel == "precomputed":
+        
+        # Only evaluate the kernel on the support vectors
+
+        K = rbf_kernel(data, self.clf_support_vectors, gamma=self.clf_gamma)
+        return np.where(np.dot(K, self.clf_dual_coef) + self.clf_intercept > 0, 1, -1)
+
+      return self.clf.predict(data)
+
   def predict(self, input_data, transform_features=False):
     '''Make a prediction for the input data with the machine learning classifier.
-    input_data is a list of (phi1, psi1, phi2, psi2, [shift], theta_x, theta_y, theta_z].
+    input_data is an (N, 10) array of (phi1, psi1, phi2, psi2, shift_x, shift_y, shift_z,
+    theta_x, theta_y, theta_z).
     '''
-    transformed_data = [[d[0], d[1], d[2], d[3]] + list(d[4]) + [d[5], d[6], d[7]]
-            for d in input_data] 
+    transformed_data = input_data
     
     if transform_features:
       transformed_data = self.transform_features(input_data) 
-    return self.clf.predict(transformed_data)
+    return self.classify(transformed_data)
 
   def generate_random_features(self, NUM_SAMPLES=10000):
-    '''Generate a list of random features.'''
-
-    phis1 = np.random.uniform(-np.pi, np.pi, NUM_SAMPLES)
-    psis1 = np.random.uniform(-np.pi, np.pi, NUM_SAMPLES)
-    phis2 = np.random.uniform(-np.pi, np.pi, NUM_SAMPLES)
-    psis2 = np.random.uniform(-np.pi, np.pi, NUM_SAMPLES)
-    shifts = [None] * NUM_SAMPLES
-    txs = [None] * NUM_SAMPLES
-    tys = [None] * NUM_SAMPLES
-    tzs = [None] * NUM_SAMPLES
-    for i in range(NUM_SAMPLES):
-      shifts[i] = np.random.uniform(3.5, 6) * geometry.random_unit_vector()
-      txs[i], tys[i], tzs[i] = geometry.random_euler_angles()
-
-    return list(zip(phis1, psis1, phis2, psis2, shifts, txs, tys, tzs))
+    '''Generate an (N, 10) array of random features.'''
+
+    torsions = np.random.uniform(-np.pi, np.pi, (NUM_SAMPLES, 4))
+    shifts = np.random.uniform(3.5, 6, (NUM_SAMPLES, 1)) * geometry.random_unit_vectors(NUM_SAMPLES)
+    txs, tys, tzs = geometry.rotation_matrices_to_euler_angles(geometry.random_rotation_matrices(NUM_SAMPLES))
+
+    return np.column_stack([torsions, shifts, txs, tys, tzs])
+
+  def random_features(self, NUM_SAMPLES=10000, transform_features=False):
+    '''Return a cached array of random features. The same sample is
+    returned for the same arguments, so repeated evaluations don't
+    regenerate and transform it.
+    '''
+    key = (NUM_SAMPLES, transform_features)
+
+    if key not in self._random_cache:
+      random_data = self.generate_random_features(NUM_SAMPLES)
+      if transform_features:
+        random_data = self.transform_features(random_data)
+      self._random_cache[key] = np.ascontiguousarray(random_data, dtype=np.float64)
+
+    return self._random_cache[key]
 
   def calculate_space_reduction(self, transform_features=False):
     '''Calculate the space reduction power of the machine learning model.'''
-    predictions = self.predict(self.generate_random_features(), transform_features=transform_features)
-    print("The space is reduced by {0}.".format(len(predictions[1 == predictions]) / len(predictions)))
+    predictions = self.classify(self.random_features(transform_features=transform_features))
+    print("The space is reduced by {0}.".format((predictions == 1).mean()))
 
   def density_estimate(self, de_type="GaussianMixture", transform_features=True):
-    '''Get a density estimation of the data.'''
-    all_data = [[d['phi1'], d['psi1'], d['phi2'], d['psi2']] + list(d['shift']) + [d['theta_x'], d['theta_y'], d['theta_z']]
-            for d in self.feature_list]
+    '''Get a density estimation of the data. The de_type can be
+    "GaussianMixture" or "KNN". The KNN density score of a point is
+    the negative log distance to its 5th nearest training point.
+    '''
+    if de_type not in ["GaussianMixture", "KNN"]:
+      raise ValueError('Unknown de_type "{0}". The de_type should be "GaussianMixture" or "KNN".'.format(de_type))
+
+    all_data = self.features
     if transform_features:
-      all_data = self.transform_features(self.feature_list)
+      all_data = self.transform_features(all_data)
+    all_data = np.ascontiguousarray(all_data, dtype=np.float64)
     n_data = len(all_data)
 
     training_data = all_data[0:int(0.7 * n_data)]
@@ -207,56 +372,79 @@ class BackboneMicroEnvironmentFeature(Feature):
     
     # Make some random data
     
-    random_data = self.generate_random_features()
-    if transform_features: 
-        random_data = self.transform_features(random_data)
+    random_data = self.random_features(transform_features=transform_features)
     
     if de_type == "GaussianMixture":
-      self.de = mixture.BayesianGaussianMixture(n_components=1000, covariance_type='full').fit(training_data)
-      
-      # Evalute the cumulative distribution functions of scores of test data
+      with sklearn.config_context(assume_finite=True):
+        self.de = mixture.BayesianGaussianMixture(n_components=1000, covariance_type='full').fit(training_data)
+        test_scores = self.de.score_samples(test_data)
+        random_scores = self.de.score_samples(random_data)
 
-      test_scores = self.de.score_samples(test_data)
-      values, base = np.histogram(test_scores, bins=40)
-      cumulative = np.cumsum(values)
+    elif de_type == "KNN":
+      self.de = cKDTree(training_data)
+      test_scores = self.knn_density_scores(test_data)
+      random_scores = self.knn_density_scores(random_data)
 
-      for i in range(40):
-          
-        # Evaluate the space compression
+    # Evalute the cumulative distribution functions of scores of test data
 
-        random_scores = self.de.score_samples(random_data)
-        compress_coe = len(random_scores[random_scores > base[i]]) / len(random_scores)
-          
-        print('{0:.3f}\t{1}\t{2:.5f}\t{3:.5f}'.format(base[i], cumulative[i], cumulative[i] / len(test_data), compress_coe))
+    values, base = np.histogram(test_scores, bins=40)
+    cumulative = np.cumsum(values)
+
+    # Evaluate the space compression
+
+    for i in range(40):
+      compress_coe = (random_scores > base[i]).mean()
+        
+      print('{0:.3f}\t{1}\t{2:.5f}\t{3:.5f}'.format(base[i], cumulative[i], cumulative[i] / len(test_data), compress_coe))
+
+  def knn_density_scores(self, data, k=5):
+    '''Return the negative log distances from the data points to
+    their k-th nearest neighbors in the KDTree density estimator.
+    '''
+    d, _ = self.de.query(data, k=k, workers=-1)
+
+    return -np.log(np.maximum(d[:, -1], np.finfo(np.float64).tiny))
 
   def visualize(self):
     pass
 
-  def plot_nearst_nonbonded_list(self, nearest_nb_list):
-    '''A debugging function to print the nearest nonbonded residue list.'''
-    X = [pair[0]['CA'].get_coord()[0] for pair in nearest_nb_list]
-    Y = [pair[0]['CA'].get_coord()[1] for pair in nearest_nb_list]
-    Z = [pair[0]['CA'].get_coord()[2] for pair in nearest_nb_list]
-    
-    U = [pair[1]['CA'].get_coord()[0] - pair[0]['CA'].get_coord()[0] for pair in nearest_nb_list]
-    V = [pair[1]['CA'].get_coord()[1] - pair[0]['CA'].get_coord()[1] for pair in nearest_nb_list]
-    W = [pair[1]['CA'].get_coord()[2] - pair[0]['CA'].get_coord()[2] for pair in nearest_nb_list]
+  def sample_indices(self, n, max_points):
+    '''Return the indices of a uniform random sample of at most
+    max_points out of n points. Return all indices if max_points is None.
+    '''
+    if max_points is None or n <= max_points:
+      return np.arange(n)
+
+    return np.sort(np.random.default_rng().choice(n, max_points, replace=False))
+
+  def plot_nearst_nonbonded_list(self, nearest_nb_list, max_points=5000):
+    '''A debugging function to print the nearest nonbonded residue list.
+    At most max_points pairs are plotted.
+    '''
+    nearest_nb_list = [nearest_nb_list[i] for i in self.sample_indices(len(nearest_nb_list), max_points)]
+
+    ca1 = np.array([pair[0]['CA'].get_coord() for pair in nearest_nb_list])
+    ca2 = np.array([pair[1]['CA'].get_coord() for pair in nearest_nb_list])
+    shifts = ca2 - ca1
 
     fig = plt.figure()
     ax = fig.gca(projection='3d')
-    ax.quiver(X, Y, Z, U, V, W)
+    ax.quiver(ca1[:, 0], ca1[:, 1], ca1[:, 2], shifts[:, 0], shifts[:, 1], shifts[:, 2])
     plt.show()
 
-  def plot_shifts(self):
+  def plot_shifts(self, max_points=5000):
     '''Plot the distribution of the translational shifts from the 
     CA atom of the first residue to the CA atom of the second residue.
+    At most max_points randomly sampled shifts are plotted.
     '''
 
     # Data points
 
-    X = [d['shift'][0] for d in self.feature_list]
-    Y = [d['shift'][1] for d in self.feature_list]
-    Z = [d['shift'][2] for d in self.feature_list]
+    idx = self.sample_indices(len(self.features), max_points)
+
+    X = self.features[idx, 4]
+    Y = self.features[idx, 5]
+    Z = self.features[idx, 6]
 
     # Postions of N and C
 
@@ -273,7 +461,7 @@ class BackboneMicroEnvironmentFeature(Feature):
   def plot_shift_length_histogram(self):
     '''Plot a histogram of the lengths of translational shifts.'''
 
-    lengths = [np.linalg.norm(d['shift']) for d in self.feature_list]
+    lengths = np.linalg.norm(self.features[:, 4:7], axis=1)
     hist, bin_edges = np.histogram(lengths, bins=0.5 * np.arange(20))
 
     plt.bar(bin_edges[0:-1] - 0.25, hist, width=0.5, edgecolor='black')
@@ -281,23 +469,29 @@ class BackboneMicroEnvironmentFeature(Feature):
 
   def scatter_plot_two_features(self, feature1_l, feature2_l, axis=None):
     '''Make a scatter plot of two features. feature1_l and feature2_l
-    are lambda expressions for pick a feature.
+    are lambda expressions for picking a feature column from the
+    dictionary returned by feature_columns().
     '''
+    columns = self.feature_columns()
 
-    f1 = [feature1_l(d) for d in self.feature_list]
-    f2 = [feature2_l(d) for d in self.feature_list]
+    f1 = feature1_l(columns)
+    f2 = feature2_l(columns)
 
     plt.scatter(f1, f2, s=5)
     if axis:
       plt.axis(axis)
     plt.show()
 
-  def scatter_plot_three_features(self, feature1_l, feature2_l, feature3_l, axis=None):
-    '''Make a scatter plot of three features, given their lambda expressions.'''
+  def scatter_plot_three_features(self, feature1_l, feature2_l, feature3_l, axis=None, max_points=5000):
+    '''Make a scatter plot of three features, given their lambda expressions.
+    At most max_points randomly sampled points are plotted.
+    '''
+    columns = self.feature_columns()
+    idx = self.sample_indices(len(self.features), max_points)
 
-    f1 = [feature1_l(d) for d in self.feature_list]
-    f2 = [feature2_l(d) for d in self.feature_list]
-    f3 = [feature3_l(d) for d in self.feature_list]
+    f1 = feature1_l(columns)[idx]
+    f2 = feature2_l(columns)[idx]
+    f3 = feature3_l(columns)[idx]
 
     fig = plt.figure()
     ax = fig.gca(projection='3d')
@@ -12,24 +12,34 @@ class Feature:
   '''Base class for features.'''
 
   def __init__(self):
-    self.feature_list = []
+    pass
 
   def list_my_jobs(self, input_path, total_num_threads, my_id):
     '''List all the inputs that should be hanled by the running thread.'''
     all_jobs = os.listdir(input_path)
     return [all_jobs[i] for i in range(len(all_jobs)) if i % total_num_threads == my_id]
 
-  def append_to_csv(self, dataframe, file_name):
-    '''Append a pandas dataframe to a csv file. This function is thread save.'''
-    
-    # Make a lock
-
+  def make_file_lock(self, file_name):
+    '''Make a lock for writing to a file from multiple jobs.'''
     lock_name = os.path.join(file_name + '.lock')
     lock = Lock(lock_name)
     lock.lifetime = timedelta(minutes=10)
 
+    return lock
+
+  def append_to_csv(self, dataframe, file_name):
+    '''Append a pandas dataframe to a csv file. This function is thread save.'''
+    
     # Write to the result file with a lock
     
-    with lock:
+    with self.make_file_lock(file_name):
       with open(file_name, 'a+') as f:
         dataframe.to_csv(f, header=False, index=False)
+
+  def append_to_binary(self, array, file_name, dtype='<f4'):
+    '''Append a numpy array to a binary file of raw values. By default
+    the values are saved as little-endian float32. This function is thread save.
+    '''
+    with self.make_file_lock(file_name):
+      with open(file_name, 'ab') as f:
+        np.ascontiguousarray(array, dtype=dtype).tofile(f)
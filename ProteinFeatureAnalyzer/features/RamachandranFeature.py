@@ -22,6 +22,7 @@ class RamachandranFeature(Feature):
   
   def __init__(self):
     super().__init__()
+    self.feature_list = []
     self.clf = None
     self.de = None
 
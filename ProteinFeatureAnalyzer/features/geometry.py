@@ -3,6 +3,8 @@ import scipy
 import scipy.spatial
 import Bio.PDB as PDB
 
+from . import geometry_jit
+
 
 def angle(v1, v2):
     '''Return the angle between two vectors in radian.'''
@@ -67,6 +69,56 @@ def get_psi(chain, residue):
 
   return PDB.calc_dihedral(n, ca, c, n_next)
 
+def dihedrals(p1, p2, p3, p4):
+  '''Return the dihedrals defined by 4 arrays of points in
+  range [-pi, pi]. Each argument is an (N, 3) array and the
+  returned value is an array of N dihedrals.
+  '''
+  return geometry_jit.dihedrals(*(np.ascontiguousarray(p, dtype=np.float64) for p in (p1, p2, p3, p4)))
+
+def get_backbone_coords(chain):
+  '''Return the residues of a chain that have N, CA and C atoms
+  and an (N, 3, 3) array of the coordinates of these atoms.
+  '''
+  residues = [r for r in chain if 'N' in r and 'CA' in r and 'C' in r]
+  coords = np.array([[r[a].get_coord() for a in ('N', 'CA', 'C')] for r in residues],
+          dtype=np.float64).reshape(-1, 3, 3)
+
+  return residues, coords
+
+def structure_coords(model):
+  '''Return a dictionary that maps the chain ids of a model to
+  the backbone residues and coordinates of the chains.
+  '''
+  return {chain.get_id() : get_backbone_coords(chain) for chain in model}
+
+def compute_all_phi_psi(residues, coords):
+  '''Calculate the phi and psi torsions of the residues of a chain
+  given their backbone coordinates from get_backbone_coords. Return
+  two arrays of phis and psis. Torsions that are not defined, e.g. for
+  terminal residues, are nan.
+  '''
+  index = {r.get_id() : i for i, r in enumerate(residues)}
+
+  # Find the previous and next residues in the same way as get_phi and get_psi
+
+  prev_ids = np.array([index.get((' ', r.get_id()[1] - 1, ' '), -1) for r in residues], dtype=int)
+  next_ids = np.array([index.get((' ', r.get_id()[1] + 1, ' '), -1) for r in residues], dtype=int)
+  has_prev = prev_ids >= 0
+  has_next = next_ids >= 0
+
+  # Calculate the torsions
+
+  phis = np.full(len(residues), np.nan)
+  psis = np.full(len(residues), np.nan)
+
+  phis[has_prev] = dihedrals(coords[prev_ids[has_prev], 2], coords[has_prev, 0],
+          coords[has_prev, 1], coords[has_prev, 2])
+  psis[has_next] = dihedrals(coords[has_next, 0], coords[has_next, 1],
+          coords[has_next, 2], coords[next_ids[has_next], 0])
+
+  return phis, psis
+
 def get_distance_matrix(atom_list):
   '''Get the distance matrix of a list of atoms.'''
   return scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(
@@ -88,31 +140,31 @@ def get_nearest_nonbonded_residues(model):
       if a.get_id() == 'CA':
         ca_list.append(a)
 
-  ca_coords = [a.get_coord() for a in ca_list]
+  ca_coords = np.array([a.get_coord() for a in ca_list])
 
-  # Make a KDTree for neighbor searching
+  # Make a KDTree for neighbor searching and query all residues at once
 
-  kd_tree = scipy.spatial.KDTree(ca_coords)
+  kd_tree = scipy.spatial.cKDTree(ca_coords)
+  distances, indices = kd_tree.query(ca_coords, k=4)
 
-  # Find the nearest nonbonded neighbor of all residues
+  # Find the nearest nonbonded neighbor of all residues. Missing neighbors
+  # of small models are reported by the KDTree with the index len(ca_list)
+  # and an infinite distance.
 
-  nearest_nb_list = []
+  chain_ids = np.unique([a.get_parent().get_parent().get_id() for a in ca_list], return_inverse=True)[1]
+  res_nums = np.array([a.get_parent().get_id()[1] for a in ca_list])
+  indices = np.minimum(indices, len(ca_list) - 1)
 
-  for i in range(len(ca_list)):
-    res1 = ca_list[i].get_parent()
-    distance, indices = kd_tree.query(ca_coords[i], k=4)
+  bonded = (chain_ids[:, None] == chain_ids[indices]) \
+          & (np.abs(res_nums[:, None] - res_nums[indices]) == 1)
+  distances[bonded] = np.inf
 
-    for j in range(1, 4):
-      res2 = ca_list[indices[j]].get_parent() 
+  nearest = np.argmin(distances[:, 1:], axis=1) + 1
+  rows = np.arange(len(ca_list))
+  found = np.isfinite(distances[rows, nearest])
 
-      if res1.get_parent().get_id() == res2.get_parent().get_id() \
-         and (res1.get_id()[1] + 1 == res2.get_id()[1] \
-         or res1.get_id()[1] - 1 == res2.get_id()[1]) : # Bonded residues
-           continue
-    
-    nearest_nb_list.append((res1, res2))   
-
-  return nearest_nb_list
+  return [(ca_list[i].get_parent(), ca_list[j].get_parent())
+          for i, j in zip(rows[found], indices[rows[found], nearest[found]])]
 
 def normalize(v):
   '''Normalize a numpy array.'''
@@ -132,7 +184,7 @@ def get_stub_matrix(p1, p2, p3):
   z = normalize(np.cross(p1 - p2, y))
   x = np.cross(y, z)
 
-  return np.matrix([x, y, z]).T
+  return np.array([x, y, z]).T
 
 def get_residue_stub_matrix(residue):
   '''Constructure a coordinate frame on a residue. The origin is on the CA atom; 
@@ -147,6 +199,16 @@ def get_residue_stub_matrix(residue):
 
   return get_stub_matrix(n, ca, c), ca
 
+def compute_all_stub_matrices(coords):
+  '''Construct the coordinate frames of residues in the same way as
+  get_residue_stub_matrix, given an (N, 3, 3) array of the coordinates
+  of N, CA and C atoms. Return an (N, 3, 3) array of stub matrices and
+  an (N, 3) array of the origins, i.e. the coordinates of CA atoms.
+  '''
+  n, ca, c = (np.ascontiguousarray(coords[:, i], dtype=np.float64) for i in range(3))
+
+  return geometry_jit.stub_matrices(n, ca, c), ca
+
 def rotation_matrix_to_euler_angles(m):
   '''Return the euler angles corresponding to a rotation matrix.'''
   theta_x = np.arctan2(m[2][1], m[2][2])
@@ -155,6 +217,14 @@ def rotation_matrix_to_euler_angles(m):
 
   return theta_x, theta_y, theta_z
 
+def rotation_matrices_to_euler_angles(M):
+  '''Return the euler angles corresponding to an (N, 3, 3) array
+  of rotation matrices as three arrays of N angles.
+  '''
+  angles = geometry_jit.rotation_matrices_to_euler_angles(np.ascontiguousarray(M, dtype=np.float64))
+
+  return angles[:, 0], angles[:, 1], angles[:, 2]
+
 def euler_angles_to_rotation_matrix(theta_x, theta_y, theta_z):
   '''Return the rotation matrix corresponding to 3 Euler angles.'''
   cx = np.cos(theta_x)
@@ -176,6 +246,22 @@ def euler_angles_to_rotation_matrix(theta_x, theta_y, theta_z):
 
   return np.matmul(Z, np.matmul(Y, X))
 
+def euler_angles_to_rotation_matrices(theta_x, theta_y, theta_z):
+  '''Return an (N, 3, 3) array of rotation matrices corresponding to
+  three arrays of N Euler angles. The convention is the same as
+  euler_angles_to_rotation_matrix.
+  '''
+  cx = np.cos(theta_x)
+  sx = np.sin(theta_x)
+  cy = np.cos(theta_y)
+  sy = np.sin(theta_y)
+  cz = np.cos(theta_z)
+  sz = np.sin(theta_z)
+
+  return np.stack([np.stack([cz * cy, cz * sy * sx - sz * cx, cz * sy * cx + sz * sx], axis=-1),
+                   np.stack([sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx], axis=-1),
+                   np.stack([    -sy,                cy * sx,                cy * cx], axis=-1)], axis=-2)
+
 def random_unit_vector(dim=3):
   '''Generate a random unit vector following the
   uniform distribution on the (dim - 1) dimension sphere.
@@ -199,6 +285,41 @@ def random_rotation_matrix():
 
   return np.array([x, y, z])
 
+def random_unit_vectors(n, dim=3):
+  '''Generate n random unit vectors following the uniform
+  distribution on the (dim - 1) dimension sphere. Return
+  an (n, dim) array.
+  '''
+  v = np.random.normal(size=(n, dim))
+  norms = np.linalg.norm(v, axis=1)
+
+  while (norms == 0).any():
+    zeros = norms == 0
+    v[zeros] = np.random.normal(size=(zeros.sum(), dim))
+    norms[zeros] = np.linalg.norm(v[zeros], axis=1)
+
+  return v / norms[:, np.newaxis]
+
+def random_rotation_matrices(n):
+  '''Generate an (n, 3, 3) array of random rotation matrices
+  following the uniform distribution in SO(3).
+  '''
+  x = random_unit_vectors(n)
+  t = random_unit_vectors(n)
+  y = np.cross(x, t)
+  norms = np.linalg.norm(y, axis=1)
+
+  while (norms == 0).any():
+    zeros = norms == 0
+    t[zeros] = random_unit_vectors(zeros.sum())
+    y[zeros] = np.cross(x[zeros], t[zeros])
+    norms[zeros] = np.linalg.norm(y[zeros], axis=1)
+
+  y = y / norms[:, np.newaxis]
+  z = np.cross(x, y)
+
+  return np.stack([x, y, z], axis=1)
+
 def random_euler_angles():
   '''Generate a random euler angles following the
   uniform distribution in SO(3).
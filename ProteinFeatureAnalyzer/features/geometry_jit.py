@@ -0,0 +1,79 @@
+'''JIT compiled kernels for the batched geometry functions.
+The kernels only take and return contiguous float64 arrays.
+'''
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _normalize(v):
+  '''Normalize a 3-vector.'''
+  norm = np.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+  if norm == 0:
+    return v
+  return v / norm
+
+@njit(cache=True)
+def _cross(a, b):
+  '''Cross product of two 3-vectors.'''
+  return np.array([a[1] * b[2] - a[2] * b[1],
+                   a[2] * b[0] - a[0] * b[2],
+                   a[0] * b[1] - a[1] * b[0]])
+
+@njit(cache=True)
+def dihedrals(p1, p2, p3, p4):
+  '''Return the dihedrals defined by 4 (N, 3) arrays of points.'''
+  n = p1.shape[0]
+  result = np.empty(n)
+
+  for i in range(n):
+    b1 = p2[i] - p1[i]
+    b2 = p3[i] - p2[i]
+    b3 = p4[i] - p3[i]
+
+    n1 = _cross(b1, b2)
+    n2 = _cross(b2, b3)
+
+    c = np.dot(n1, n2)
+    s = np.dot(_cross(n1, n2), _normalize(b2))
+
+    result[i] = np.arctan2(s, c)
+
+  return result
+
+@njit(cache=True)
+def stub_matrices(n, ca, c):
+  '''Return an (N, 3, 3) array of stub matrices given (N, 3) arrays
+  of N, CA and C coordinates. The convention is the same as
+  geometry.get_stub_matrix.
+  '''
+  m = n.shape[0]
+  stubs = np.empty((m, 3, 3))
+
+  for i in range(m):
+    y = _normalize(c[i] - ca[i])
+    z = _normalize(_cross(n[i] - ca[i], y))
+    x = _cross(y, z)
+
+    for j in range(3):
+      stubs[i, j, 0] = x[j]
+      stubs[i, j, 1] = y[j]
+      stubs[i, j, 2] = z[j]
+
+  return stubs
+
+@njit(cache=True)
+def rotation_matrices_to_euler_angles(M):
+  '''Return an (N, 3) array of euler angles of an (N, 3, 3) array
+  of rotation matrices.
+  '''
+  n = M.shape[0]
+  angles = np.empty((n, 3))
+
+  for i in range(n):
+    angles[i, 0] = np.arctan2(M[i, 2, 1], M[i, 2, 2])
+    angles[i, 1] = np.arctan2(-M[i, 2, 0], np.sqrt(M[i, 2, 1]**2 + M[i, 2, 2]**2))
+    angles[i, 2] = np.arctan2(M[i, 1, 0], M[i, 0, 0])
+
+  return angles
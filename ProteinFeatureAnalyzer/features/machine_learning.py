@@ -9,6 +9,12 @@ def angle_to_cos_sin(angle):
   '''
   return [np.cos(angle), np.sin(angle)]
 
+def angles_to_cos_sin(angles):
+  '''Convert an (N, M) array of angles in radian to an (N, 2M)
+  array in which each angle is replaced by its cos and sin.
+  '''
+  return np.stack([np.cos(angles), np.sin(angles)], axis=-1).reshape(angles.shape[0], -1)
+
 def cos_sin_to_angle(cos, sin):
   '''Get an angle from its cos and sin.
   The range of the angle is [-pi, -pi]
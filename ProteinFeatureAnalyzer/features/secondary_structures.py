@@ -1,6 +1,9 @@
+import io
 import subprocess
+import warnings
 
 import numpy as np
+import pandas as pd
 import Bio.PDB as PDB
 import networkx as nx
 import cylinder_fitting
@@ -29,8 +32,12 @@ def make_dssp_dict(pdb_path, dssp_path):
     if not out.strip():
       raise Exception('DSSP failed to produce an output')
 
-  # Parse the DSSP output
+  return parse_dssp_output(out)
 
+def parse_dssp_output(out):
+  '''Parse the output of DSSP into a dictionary whose keys are
+  (chain_id, res_id) and a map from dssp sequential number to keys.
+  '''
   lines = out.split('\n')
   i = 0
 
@@ -39,38 +46,49 @@ def make_dssp_dict(pdb_path, dssp_path):
   while len(lines[i].split()) < 2 or lines[i].split()[1] != 'RESIDUE':
     i += 1
 
-  # Parse line by line
-
-  dssp_dict = {}
-  key_map = {}
-
-  for l in lines[i + 1:]:
-    if len(l.strip()) == 0: continue
-    if l[9] == " ":
-            # Skip -- missing residue
-            continue
-
-    seq_num = int(l[0:5])   # Sequential residue number,including chain breaks as extra residues
-    res_id = int(l[5:10])   # Residue ID in PDB file
-    chain_id = l[11]        # Chain ID
-    ss = l[16]              # Secondary structure
-    bbl1 = l[23]            # Beta bridge label 1
-    bbl2 = l[24]            # Beta bridge label 2
-    bp1 = int(l[26:29])     # Beta bridge partner 1
-    bp2 = int(l[30:33])     # Beta bridge partner 2
-    bsl = l[33]             # Beta sheet label
-    nh_to_o1 = l[39:50].split(',')     # Hydrogen bond from NH to O 1
-    o_to_nh1 = l[50:61].split(',')     # Hydrogen bond from O to NH 1
-    nh_to_o2 = l[61:72].split(',')     # Hydrogen bond from NH to O 2
-    o_to_nh2 = l[72:83].split(',')     # Hydrogen bond from O to NH 2
-
-    key_map[seq_num] = (chain_id, res_id)
-    dssp_dict[(chain_id, res_id)] = {'seq_num':seq_num, 'ss':ss,
-            'bbl1':bbl1, 'bbl2':bbl2, 'bp1':bp1, 'bp2':bp2, 'bsl':bsl,
-            'nh_to_o1':(int(nh_to_o1[0]), float(nh_to_o1[1])),
-            'o_to_nh1':(int(o_to_nh1[0]), float(o_to_nh1[1])),
-            'nh_to_o2':(int(nh_to_o2[0]), float(nh_to_o2[1])),
-            'o_to_nh2':(int(o_to_nh2[0]), float(o_to_nh2[1])) }
+  # Parse the fixed width columns
+
+  columns = [('seq_num', (0, 5)),      # Sequential residue number,including chain breaks as extra residues
+             ('res_id', (5, 10)),      # Residue ID in PDB file
+             ('chain_id', (11, 12)),   # Chain ID
+             ('ss', (16, 17)),         # Secondary structure
+             ('bbl1', (23, 24)),       # Beta bridge label 1
+             ('bbl2', (24, 25)),       # Beta bridge label 2
+             ('bp1', (26, 29)),        # Beta bridge partner 1
+             ('bp2', (30, 33)),        # Beta bridge partner 2
+             ('bsl', (33, 34)),        # Beta sheet label
+             ('nh_to_o1', (39, 50)),   # Hydrogen bond from NH to O 1
+             ('o_to_nh1', (50, 61)),   # Hydrogen bond from O to NH 1
+             ('nh_to_o2', (61, 72)),   # Hydrogen bond from NH to O 2
+             ('o_to_nh2', (72, 83))]   # Hydrogen bond from O to NH 2
+
+  df = pd.read_fwf(io.StringIO('\n'.join(lines[i + 1:])), colspecs=[c[1] for c in columns],
+          names=[c[0] for c in columns], header=None, dtype=str, keep_default_na=False)
+
+  df = df[df['res_id'] != ''] # Skip -- missing residue
+
+  if len(df) == 0:
+    return {}, {}
+
+  seq_nums = df['seq_num'].astype(int).tolist()
+  keys = list(zip(df['chain_id'].replace('', ' '), df['res_id'].astype(int).tolist()))
+  
+  values = {'seq_num':seq_nums}
+
+  for c in ['ss', 'bbl1', 'bbl2', 'bsl']:
+    values[c] = df[c].replace('', ' ').tolist()
+
+  for c in ['bp1', 'bp2']:
+    values[c] = df[c].astype(int).tolist()
+
+  for c in ['nh_to_o1', 'o_to_nh1', 'nh_to_o2', 'o_to_nh2']:
+    hbonds = df[c].str.split(',', expand=True)
+    values[c] = list(zip(hbonds[0].astype(int).tolist(), hbonds[1].astype(float).tolist()))
+
+  # Pack the columns into dictionaries
+
+  key_map = dict(zip(seq_nums, keys))
+  dssp_dict = {key : {c : values[c][j] for c in values} for j, key in enumerate(keys)}
 
   return dssp_dict, key_map
 
@@ -247,23 +265,28 @@ class BetaSheet(SecondaryStructure):
         self.graph.add_edge(strand.residue_list[i],
                 strand.residue_list[i + 1], edge_type='pp_bond')
 
+    # Look up the DSSP entries of all residues once
+
+    entry_of = {id(res) : dssp_dict[(res.get_parent().get_id(), res.get_id()[1])] for res in residues}
+    residue_ids = set(entry_of.keys())
+
     # Add the beta pairs
 
     for res in residues:
-      d = dssp_dict[(res.get_parent().get_id(), res.get_id()[1])]
+      d = entry_of[id(res)]
       
       for value in ['bp1', 'bp2']:
         if d[value] > 0:
           key = key_map[d[value]]
           res2 = model[key[0]][key[1]]
 
-          if res2 in residues:
+          if id(res2) in residue_ids:
             self.graph.add_edge(res, res2, edge_type='bp')
 
     # Add the hydrogen bonds
 
     for res in residues:
-      d = dssp_dict[(res.get_parent().get_id(), res.get_id()[1])]
+      d = entry_of[id(res)]
 
       # Add a hydrogen bond if the H bond energy is below a limit
 
@@ -274,7 +297,7 @@ class BetaSheet(SecondaryStructure):
           key = key_map[d['seq_num'] + d[value][0]]
           res2 = model[key[0]][key[1]]
           
-          if res2 in residues:
+          if id(res2) in residue_ids:
             self.graph.add_edge(res, res2, edge_type=value)
         
   def get_prev_node(self, residue):
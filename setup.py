@@ -23,6 +23,7 @@ setup(
         'sklearn',
         'pytest',
         'cylinder_fitting',
+        'numba',
     ],
     entry_points={
         'console_scripts': [
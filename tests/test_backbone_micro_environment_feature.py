@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+import numpy as np
+from sklearn import svm
+from sklearn.metrics.pairwise import rbf_kernel
+
+from ProteinFeatureAnalyzer.features.BackboneMicroEnvironmentFeature import *
+
+
+def test_feature_buffer():
+  feature = BackboneMicroEnvironmentFeature()
+  assert(feature.features.shape == (0, 10))
+
+  # Append chunks that overflow the buffer several times
+
+  chunks = [np.random.uniform(-1, 1, (n, 10)) for n in [3, 0, 1, 7, 20, 2]]
+
+  for chunk in chunks:
+    feature._buf_extend(chunk)
+    assert(len(feature._buf) >= len(feature.features))
+
+  all_rows = np.concatenate(chunks)
+  assert(np.array_equal(feature.features, all_rows))
+
+  # The feature columns are views of the buffer
+
+  columns = feature.feature_columns()
+  assert(np.array_equal(columns['phi1'], all_rows[:, 0]))
+  assert(np.array_equal(columns['psi2'], all_rows[:, 3]))
+  assert(np.array_equal(columns['shift'], all_rows[:, 4:7].T))
+  assert(np.array_equal(columns['theta_z'], all_rows[:, 9]))
+
+def test_extract_row_order():
+  input_path = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'small')
+
+  feature = BackboneMicroEnvironmentFeature()
+  feature.extract(input_path)
+
+  # The rows are in the order of the input files
+
+  expected = np.concatenate([extract_from_one_file(os.path.join(input_path, f))
+      for f in feature.list_my_jobs(input_path, 1, 0) if f.endswith('.pdb')])
+
+  assert(len(expected) > 0)
+  assert(np.array_equal(feature.features, expected))
+
+def test_pooled_extract():
+  input_path = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'small')
+
+  serial = BackboneMicroEnvironmentFeature()
+  serial.extract(input_path)
+
+  pooled = BackboneMicroEnvironmentFeature()
+  pooled.extract(input_path, num_processes=3)
+
+  assert(np.array_equal(pooled.features, serial.features))
+
+def test_serial_then_pooled_extract():
+  # The pool is forked after the parent has run the compiled kernels.
+  # Run in a subprocess since a broken pool hangs the interpreter at exit.
+
+  root = os.path.join(os.path.dirname(__file__), '..')
+  script = '''
+import ProteinFeatureAnalyzer as PFA
+feature = PFA.features.BackboneMicroEnvironmentFeature()
+feature.extract('inputs/small')
+feature.extract('inputs/small', num_processes=2)
+'''
+  env = dict(os.environ, PYTHONPATH=os.path.abspath(root))
+  result = subprocess.run([sys.executable, '-c', script], cwd=root, env=env, timeout=300)
+
+  assert(result.returncode == 0)
+
+def test_save_and_load(tmp_path):
+  rows = np.random.uniform(-np.pi, np.pi, (50, 10))
+
+  feature = BackboneMicroEnvironmentFeature()
+  feature._buf_extend(rows)
+  feature.save(str(tmp_path))
+
+  # The features are saved as float32
+
+  loaded = BackboneMicroEnvironmentFeature()
+  loaded.load(str(tmp_path))
+  assert(np.array_equal(loaded.features, rows.astype(np.float32)))
+
+  # Saving again appends to the file
+
+  feature.save(str(tmp_path))
+
+  loaded = BackboneMicroEnvironmentFeature()
+  loaded.load(str(tmp_path))
+  assert(np.array_equal(loaded.features, np.vstack([rows, rows]).astype(np.float32)))
+
+  # Loading into a non-empty buffer copies the data into the buffer
+
+  feature.load(str(tmp_path))
+  assert(feature.features.dtype == np.float64)
+  assert(np.allclose(feature.features, np.vstack([rows, rows, rows]), atol=1e-6))
+
+def test_extract_to_data_path(tmp_path):
+  input_path = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'small')
+
+  feature = BackboneMicroEnvironmentFeature()
+  feature.extract(input_path)
+
+  # The features are written to the data path instead of the buffer
+
+  streamed = BackboneMicroEnvironmentFeature()
+  streamed.extract(input_path, data_path=str(tmp_path))
+  assert(len(streamed.features) == 0)
+
+  streamed.load(str(tmp_path))
+  assert(np.array_equal(streamed.features, feature.features.astype(np.float32)))
+
+def test_csv_to_binary(tmp_path):
+  rows = np.random.uniform(-np.pi, np.pi, (50, 10))
+  np.savetxt(os.path.join(str(tmp_path), 'bb_micro_env_features.csv'), rows, delimiter=',', fmt='%.9g')
+
+  # Loading a data path with only a csv file converts it
+
+  feature = BackboneMicroEnvironmentFeature()
+  feature.load(str(tmp_path))
+  assert(os.path.exists(os.path.join(str(tmp_path), 'bb_micro_env_features.bin')))
+  assert(np.allclose(feature.features, rows, atol=1e-6))
+
+  # Converting again doesn't duplicate the features
+
+  feature.csv_to_binary(str(tmp_path))
+
+  loaded = BackboneMicroEnvironmentFeature()
+  loaded.load(str(tmp_path))
+  assert(np.array_equal(loaded.features, feature.features))
+
+def learn_svm_on_random_data():
+  np.random.seed(42)
+
+  feature = BackboneMicroEnvironmentFeature()
+  feature._buf_extend(np.random.normal(size=(500, 10)))
+  feature.learn()
+
+  return feature
+
+def test_classify_precomputed_kernel_svm():
+  feature = learn_svm_on_random_data()
+  assert(feature.clf.kernel == 'precomputed')
+
+  X = np.random.normal(scale=1.2, size=(2000, 10))
+  predictions = feature.classify(X)
+
+  # Compare with the predictions of sklearn
+
+  K = rbf_kernel(X, feature.clf_training_data, gamma=feature.clf_gamma)
+  assert(np.array_equal(predictions, feature.clf.predict(K)))
+
+  clf = svm.OneClassSVM(nu=feature.clf.nu, kernel='rbf', gamma='auto').fit(feature.clf_training_data)
+  assert(np.array_equal(predictions, clf.predict(X)))
+
+def test_classify_large_training_set_svm(monkeypatch):
+  module = sys.modules[BackboneMicroEnvironmentFeature.__module__]
+  monkeypatch.setattr(module, 'MAX_PRECOMPUTED_KERNEL_SIZE', 100)
+
+  feature = learn_svm_on_random_data()
+  assert(feature.clf.kernel == 'rbf')
+
+  X = np.random.normal(scale=1.2, size=(2000, 10))
+  
+  clf = svm.OneClassSVM(nu=feature.clf.nu, kernel='rbf', gamma='auto').fit(feature.clf_training_data)
+  assert(np.array_equal(feature.classify(X), clf.predict(X)))
+
+def test_density_estimate_type():
+  feature = BackboneMicroEnvironmentFeature()
+
+  with pytest.raises(ValueError):
+    feature.density_estimate(de_type="KernelDensity")
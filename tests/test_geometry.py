@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
+import os
+
 import pytest
 
 import numpy as np
 
 from ProteinFeatureAnalyzer.features.geometry import *
+from ProteinFeatureAnalyzer.features.data_loading import structure_from_pdb_file
 
 
 def test_rotation_representation_conversion():
@@ -28,3 +31,91 @@ def test_rotation_representation_conversion():
   for i in range(3):
     for j in range(3):
       assert(abs(rot_m[i][j] - rot_m2[i][j]) < 0.001)
+
+  # Test the batched conversion
+
+  txs, tys, tzs = rotation_matrices_to_euler_angles(np.array([rot_m, rot_m2]))
+
+  for i in range(2):
+    assert(abs(theta_x - txs[i]) < 0.001)
+    assert(abs(theta_y - tys[i]) < 0.001)
+    assert(abs(theta_z - tzs[i]) < 0.001)
+
+def test_dihedrals():
+
+  points = np.random.uniform(-10, 10, (4, 100, 3))
+  torsions = dihedrals(points[0], points[1], points[2], points[3])
+
+  for i in range(100):
+    assert(abs(dihedral(points[0][i], points[1][i], points[2][i], points[3][i]) - torsions[i]) < 0.001)
+
+def test_get_nearest_nonbonded_residues():
+
+  pdb_file = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'mini', '11gs.pdb')
+  model = structure_from_pdb_file(pdb_file)[0]
+
+  def bonded(r1, r2):
+    return r1.get_parent().get_id() == r2.get_parent().get_id() \
+            and abs(r1.get_id()[1] - r2.get_id()[1]) == 1
+
+  residues = [r for r in model.get_residues() if r.get_id()[0] == ' ' and 'CA' in r]
+
+  for res1, res2 in get_nearest_nonbonded_residues(model):
+    assert(res1 is not res2 and not bonded(res1, res2))
+
+    d = np.linalg.norm(res2['CA'].get_coord() - res1['CA'].get_coord())
+    for r in residues:
+      if r is not res1 and not bonded(res1, r):
+        assert(np.linalg.norm(r['CA'].get_coord() - res1['CA'].get_coord()) >= d - 1e-5)
+
+def test_compute_all_stub_matrices():
+
+  pdb_file = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'mini', '11gs.pdb')
+  model = structure_from_pdb_file(pdb_file)[0]
+
+  for residues, coords in structure_coords(model).values():
+    stubs, cas = compute_all_stub_matrices(coords)
+
+    for i, r in enumerate(residues):
+      stub, ca = get_residue_stub_matrix(r)
+      assert(np.allclose(stub, stubs[i], atol=1e-5))
+      assert(np.allclose(ca, cas[i]))
+
+def test_compute_all_phi_psi():
+
+  pdb_file = os.path.join(os.path.dirname(__file__), '..', 'inputs', 'mini', '11gs.pdb')
+  model = structure_from_pdb_file(pdb_file)[0]
+
+  for chain in model:
+    residues, coords = get_backbone_coords(chain)
+    phis, psis = compute_all_phi_psi(residues, coords)
+
+    for i, r in enumerate(residues):
+      try:
+        assert(abs(get_phi(chain, r) - phis[i]) < 0.001)
+      except KeyError:
+        assert(np.isnan(phis[i]))
+
+      try:
+        assert(abs(get_psi(chain, r) - psis[i]) < 0.001)
+      except KeyError:
+        assert(np.isnan(psis[i]))
+
+def test_euler_angles_to_rotation_matrices():
+
+  txs = np.random.uniform(-np.pi, np.pi, 100)
+  tys = np.random.uniform(-np.pi / 2, np.pi / 2, 100)
+  tzs = np.random.uniform(-np.pi, np.pi, 100)
+
+  rot_ms = euler_angles_to_rotation_matrices(txs, tys, tzs)
+
+  for i in range(100):
+    assert(np.allclose(euler_angles_to_rotation_matrix(txs[i], tys[i], tzs[i]), rot_ms[i]))
+
+def test_random_rotation_matrices():
+
+  rot_ms = random_rotation_matrices(100)
+
+  for i in range(100):
+    assert(np.allclose(np.dot(rot_ms[i], rot_ms[i].T), np.identity(3)))
+    assert(abs(np.linalg.det(rot_ms[i]) - 1) < 0.001)
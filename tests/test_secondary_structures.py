@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from ProteinFeatureAnalyzer.features.secondary_structures import parse_dssp_output
+
+
+DSSP_HEADER = '''==== Secondary Structure Definition by the program DSSP, CMBI version 2.0.4 ==== DATE=2017-01-01        .
+REFERENCE W. KABSCH AND C.SANDER, BIOPOLYMERS 22 (1983) 2577-2637                                        .
+    6  2  0  0  0 TOTAL NUMBER OF RESIDUES, NUMBER OF CHAINS, NUMBER OF SS-BRIDGES(TOTAL,INTRACHAIN,INTERCHAIN)                .
+  #  RESIDUE AA STRUCTURE BP1 BP2  ACC     N-H-->O    O-->H-N    N-H-->O    O-->H-N    TCO  KAPPA ALPHA  PHI   PSI    X-CA   Y-CA   Z-CA
+'''
+DSSP_LINES = [
+'    1    1 A M              0   0  142      0, 0.0     2,-0.3     0, 0.0    74,-0.1  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+'    2    2 A K  E      a    9   0A  80      7,-2.4     7,-2.1     1,-0.2     2,-0.3  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+'    3    3 A V  E      ab   8  12A   3     -2,-0.5     5,-1.8     9,-2.6    -1,-0.2  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+'    4    3AA L  H           0   0   20     -4,-1.6     4,-2.2    -3,-0.4     3,-0.1  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+'    5        !              0   0    0      0, 0.0     0, 0.0     0, 0.0     0, 0.0  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+'    6    1 B G              0   0   55      0, 0.0    -1,-0.1     0, 0.0     0, 0.0  0.000 360.0 360.0 360.0 152.4   13.953  23.989  12.650',
+]
+
+def test_parse_dssp_output():
+
+  dssp_dict, key_map = parse_dssp_output(DSSP_HEADER + '\n'.join(DSSP_LINES) + '\n')
+
+  # The chain break is skipped
+
+  assert(key_map == {1:('A', 1), 2:('A', 2), 3:('A', 3), 4:('A', 3), 6:('B', 1)})
+  assert(len(dssp_dict) == 4)
+
+  d = dssp_dict[('A', 2)]
+  assert(d['seq_num'] == 2)
+  assert(d['ss'] == 'E' and d['bsl'] == 'A')
+  assert(d['bbl1'] == 'a' and d['bbl2'] == ' ')
+  assert(d['bp1'] == 9 and d['bp2'] == 0)
+  assert(d['nh_to_o1'] == (7, -2.4))
+  assert(d['o_to_nh2'] == (2, -0.3))
+
+  d = dssp_dict[('B', 1)]
+  assert(d['ss'] == ' ')
+  assert(d['o_to_nh1'] == (-1, -0.1))
+
+def test_parse_empty_dssp_output():
+
+  assert(parse_dssp_output(DSSP_HEADER) == ({}, {}))
+
+  # Only a chain break
+
+  assert(parse_dssp_output(DSSP_HEADER + DSSP_LINES[4] + '\n') == ({}, {}))